@@ -7,11 +7,17 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
-from datetime import datetime, timedelta
-import json
+from datetime import date, datetime, timedelta, timezone
+import orjson
 import uuid
 import os
-from typing import Dict, List, Optional
+import hashlib
+import re
+import threading
+import time
+import atexit
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
 
 # Configuration
 class Config:
@@ -32,6 +38,20 @@ class Config:
     DELTA_TABLE_PATH = "/tmp/delta/order_invoices"
     ORDERS_TABLE_PATH = "/tmp/delta/orders"
     
+    # Local directory for uploaded invoice files
+    UPLOAD_DIR = "uploads"
+    UPLOAD_CHUNK_SIZE = 1 << 20  # 1 MB
+    
+    # Invoice write batching: flush after this many rows or seconds, whichever comes first
+    INVOICE_BATCH_SIZE = 50
+    INVOICE_FLUSH_INTERVAL = 5.0
+    
+    # Seconds the orders table stays cached in Spark memory before it is re-read
+    ORDERS_CACHE_TTL = 60
+    
+    # Rows per Arrow record batch when converting Spark results to pandas
+    ARROW_MAX_RECORDS_PER_BATCH = 10000
+    
     @classmethod
     def get_databricks_config(cls):
         """Get Databricks configuration with proper authentication method"""
@@ -60,6 +80,39 @@ class Config:
         
         return config
 
+# Orders columns shown in the dashboard's recent orders table
+DASHBOARD_ORDER_COLUMNS = ["order_id", "customer_id", "customer_name", "order_date", "total_amount", "status"]
+
+# Full column sets, used to shape the in-memory mock tables
+ORDER_COLUMNS = ["order_id", "customer_id", "customer_name", "order_date",
+                 "total_amount", "status", "items", "created_at"]
+INVOICE_COLUMNS = ["invoice_id", "order_id", "customer_id", "invoice_number", "invoice_date",
+                   "amount", "tax_amount", "total_amount", "file_path", "file_sha256",
+                   "uploaded_at", "created_at"]
+MOCK_TABLE_COLUMNS = {"orders": ORDER_COLUMNS, "invoices": INVOICE_COLUMNS}
+
+# Accepted shape for customer/order ids coming from the UI
+_ID_RE = re.compile(r"[A-Za-z0-9_\-]{1,64}")
+
+def _validate_id(value: str, field: str = "customer_id") -> str:
+    """Reject malformed ids before they reach a query"""
+    if not _ID_RE.fullmatch(value):
+        raise ValueError(f"Invalid {field}: {value!r}")
+    return value
+
+_UNSAFE_FILENAME_CHARS = re.compile(r"[^A-Za-z0-9._-]+")
+
+def _secure_filename(name: str) -> str:
+    """Strip directory components and unsafe characters from a user-supplied file name"""
+    name = os.path.basename(name.replace("\\", "/"))
+    return _UNSAFE_FILENAME_CHARS.sub("_", name).lstrip(".") or "upload"
+
+# Delta properties applied to every app table so small appends are coalesced on write
+DELTA_TABLE_PROPERTIES = {
+    "delta.autoOptimize.optimizeWrite": "true",
+    "delta.autoOptimize.autoCompact": "true"
+}
+
 # Mock classes for when Databricks is not available
 class MockSparkSession:
     """Mock Spark session for demonstration"""
@@ -95,8 +148,8 @@ class MockDataFrameWriter:
         print(f"Mock: Saved data to table {table_name}")
         return self
     
-    def save(self):
-        print("Mock: Saved data")
+    def save(self, path=None):
+        print(f"Mock: Saved data to {path}" if path else "Mock: Saved data")
         return self
 
 class MockConnection:
@@ -108,13 +161,122 @@ class MockConnection:
 try:
     from databricks.connect import DatabricksSession
     from pyspark.sql import SparkSession
-    from pyspark.sql.types import StructType, StructField, StringType, IntegerType, DoubleType, TimestampType
+    from pyspark.sql import functions as F
+    from pyspark.sql.types import StructType, StructField, StringType, IntegerType, DoubleType, TimestampType, ArrayType
     from delta.tables import DeltaTable
     DATABRICKS_AVAILABLE = True
 except ImportError:
     DATABRICKS_AVAILABLE = False
     print("Warning: Databricks packages not available. Using mock implementation.")
 
+# Delta table schemas
+if DATABRICKS_AVAILABLE:
+    ORDER_ITEM_SCHEMA = StructType([
+        StructField("item", StringType(), True),
+        StructField("quantity", IntegerType(), True),
+        StructField("price", DoubleType(), True)
+    ])
+    ORDER_SCHEMA = StructType([
+        StructField("order_id", StringType(), False),
+        StructField("customer_id", StringType(), False),
+        StructField("customer_name", StringType(), True),
+        StructField("order_date", TimestampType(), True),
+        StructField("total_amount", DoubleType(), True),
+        StructField("status", StringType(), True),
+        StructField("items", ArrayType(ORDER_ITEM_SCHEMA), True),
+        StructField("created_at", TimestampType(), True)
+    ])
+    INVOICE_SCHEMA = StructType([
+        StructField("invoice_id", StringType(), False),
+        StructField("order_id", StringType(), False),
+        StructField("customer_id", StringType(), False),
+        StructField("invoice_number", StringType(), True),
+        StructField("invoice_date", TimestampType(), True),
+        StructField("amount", DoubleType(), True),
+        StructField("tax_amount", DoubleType(), True),
+        StructField("total_amount", DoubleType(), True),
+        StructField("file_path", StringType(), True),
+        StructField("file_sha256", StringType(), True),
+        StructField("uploaded_at", TimestampType(), True),
+        StructField("created_at", TimestampType(), True)
+    ])
+else:
+    ORDER_ITEM_SCHEMA = ORDER_SCHEMA = INVOICE_SCHEMA = None
+
+# Streamlit re-executes this module on every rerun, so a module global would
+# be reset each time; st.cache_resource keeps one session for the server process
+@st.cache_resource(show_spinner=False)
+def get_spark_session(config: Dict, cluster_id: str):
+    """Build the shared Databricks Connect session, or None if no auth method is configured"""
+    if 'token' in config:
+        spark = DatabricksSession.builder \
+            .remote(host=config['host'], token=config['token'], cluster_id=cluster_id) \
+            .getOrCreate()
+    elif 'client_id' in config:
+        spark = DatabricksSession.builder \
+            .remote(host=config['host'], client_id=config['client_id'],
+                   client_secret=config['client_secret'], cluster_id=cluster_id) \
+            .getOrCreate()
+    else:
+        return None
+    
+    # Spark Connect always returns toPandas() results as Arrow batches; only the
+    # batch size is tunable. Best effort: a rejected setting must not cost the session
+    try:
+        spark.conf.set("spark.sql.execution.arrow.maxRecordsPerBatch", str(Config.ARROW_MAX_RECORDS_PER_BATCH))
+    except Exception as e:
+        print(f"Warning: could not set Arrow batch size: {e}")
+    return spark
+
+def _prune(df, customer_id: Optional[str] = None, columns: Optional[List[str]] = None):
+    """Apply the customer predicate and column projection to a Spark DataFrame
+    
+    The id is bound as a literal in the plan rather than spliced into SQL
+    text, so every customer shares one query shape and no input can change
+    the statement.
+    """
+    if customer_id:
+        df = df.where(F.col("customer_id") == F.lit(customer_id))
+    if columns:
+        df = df.select(*columns)
+    return df
+
+def _schema_ddl(schema) -> str:
+    """Column list for CREATE TABLE, derived from a StructType"""
+    return ", ".join(
+        f"{field.name} {field.dataType.simpleString()}{'' if field.nullable else ' NOT NULL'}"
+        for field in schema.fields
+    )
+
+def _tblproperties_sql() -> str:
+    """DELTA_TABLE_PROPERTIES rendered for a TBLPROPERTIES clause"""
+    return ", ".join(f"'{key}' = '{value}'" for key, value in DELTA_TABLE_PROPERTIES.items())
+
+# Orders are partitioned by month through a generated column: Delta fills it in
+# on write, and DATE_FORMAT(ts, 'yyyy-MM') is one of the generation expressions
+# it derives partition filters for from predicates on order_date
+ORDERS_PARTITION_COLUMN = "order_month STRING GENERATED ALWAYS AS (DATE_FORMAT(order_date, 'yyyy-MM'))"
+
+def _orders_ddl(create_clause: str) -> str:
+    """DDL for the orders table, e.g. _orders_ddl("CREATE TABLE IF NOT EXISTS")"""
+    return (
+        f"{create_clause} orders ({_schema_ddl(ORDER_SCHEMA)}, {ORDERS_PARTITION_COLUMN}) USING DELTA "
+        f"PARTITIONED BY (order_month) "
+        f"LOCATION '{Config.ORDERS_TABLE_PATH}' "
+        f"TBLPROPERTIES ({_tblproperties_sql()})"
+    )
+
+def _invoices_ddl(create_clause: str) -> str:
+    """DDL for the invoices table, e.g. _invoices_ddl("CREATE TABLE IF NOT EXISTS")"""
+    return (
+        f"{create_clause} invoices ({_schema_ddl(INVOICE_SCHEMA)}) USING DELTA "
+        f"LOCATION '{Config.DELTA_TABLE_PATH}' "
+        f"TBLPROPERTIES ({_tblproperties_sql()})"
+    )
+
+class TableMigrationError(RuntimeError):
+    """An existing table has an outdated layout that could not be upgraded in place"""
+
 class DatabricksManager:
     """Manager for Databricks operations"""
     
@@ -123,205 +285,562 @@ class DatabricksManager:
         self.host = Config.DATABRICKS_HOST
         self.token = Config.DATABRICKS_TOKEN
         self.cluster_id = Config.DATABRICKS_CLUSTER_ID
-        self._spark = None
         self._connection = None
+        self._spark = None
+        self._orders_cache = None
+        self._orders_cached_at = 0.0
+        # The manager is shared by every session thread; guards the cache fields
+        self._orders_lock = threading.RLock()
+        # Tables whose DDL has run in this process; appends then write by path
+        self._ready_tables = set()
         self.mock_mode = not DATABRICKS_AVAILABLE
         self.mock_data = {
-            "orders": [],
-            "invoices": []
+            "orders": pd.DataFrame(columns=ORDER_COLUMNS),
+            "invoices": pd.DataFrame(columns=INVOICE_COLUMNS)
         }
+        # Rows added since the last read, folded into mock_data by one concat
+        self._mock_pending: Dict[str, List[Dict]] = {"orders": [], "invoices": []}
+        self._mock_lock = threading.Lock()
+        
+        # Pending invoice rows, appended to Delta in one write by flush_invoices()
+        self._invoice_buffer: List[Dict] = []
+        self._buffer_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._buffer_started: Optional[float] = None
+        self._flush_timer: Optional[threading.Timer] = None
+        atexit.register(self.flush_invoices)
     
     @property
     def spark(self):
-        """Get or create Spark session"""
+        """Get or create the shared Spark session"""
         if self.mock_mode:
             return MockSparkSession()
         
-        if self._spark is None and DATABRICKS_AVAILABLE:
+        if self._spark is None:
             try:
-                # Use the proper configuration method
-                if 'token' in self.config:
-                    self._spark = DatabricksSession.builder \
-                        .remote(host=self.config['host'], token=self.config['token'], cluster_id=self.cluster_id) \
-                        .getOrCreate()
-                elif 'client_id' in self.config:
-                    self._spark = DatabricksSession.builder \
-                        .remote(host=self.config['host'], client_id=self.config['client_id'], 
-                               client_secret=self.config['client_secret'], cluster_id=self.cluster_id) \
-                        .getOrCreate()
-                else:
-                    print("No valid authentication method found")
-                    self.mock_mode = True
-                    return MockSparkSession()
+                self._spark = get_spark_session(self.config, self.cluster_id)
             except Exception as e:
                 print(f"Failed to create Databricks session: {e}")
                 print("Switching to mock mode")
                 self.mock_mode = True
                 return MockSparkSession()
+            if self._spark is None:
+                print("No valid authentication method found")
+                self.mock_mode = True
+                return MockSparkSession()
         return self._spark
     
     def create_orders_table(self):
         """Create orders Delta table"""
         if self.mock_mode:
             print("Mock: Creating orders table")
-            self.mock_data["orders"] = []
+            self.reset_mock_table("orders")
+            _clear_order_caches()
             return
         
         if not DATABRICKS_AVAILABLE:
             print("Databricks not available, using mock mode")
-            self.mock_data["orders"] = []
+            self.reset_mock_table("orders")
             return
         
         try:
-            schema = StructType([
-                StructField("order_id", StringType(), False),
-                StructField("customer_id", StringType(), False),
-                StructField("customer_name", StringType(), True),
-                StructField("order_date", TimestampType(), True),
-                StructField("total_amount", DoubleType(), True),
-                StructField("status", StringType(), True),
-                StructField("items", StringType(), True),  # JSON string
-                StructField("created_at", TimestampType(), True)
-            ])
-            
-            # Create empty DataFrame with schema
-            empty_df = self.spark.createDataFrame([], schema)
-            
-            # Write as Delta table
-            empty_df.write \
-                .format("delta") \
-                .mode("overwrite") \
-                .option("path", Config.ORDERS_TABLE_PATH) \
-                .saveAsTable("orders")
+            # (Re)create as a partitioned Delta table
+            self.spark.sql(_orders_ddl("CREATE OR REPLACE TABLE"))
+            self._ready_tables.add("orders")
             
             print(f"Orders table created at {Config.ORDERS_TABLE_PATH}")
         except Exception as e:
             print(f"Error creating orders table: {e}")
             print("Switching to mock mode")
             self.mock_mode = True
-            self.mock_data["orders"] = []
+            self.reset_mock_table("orders")
+        finally:
+            self.invalidate_orders_cache()
+            _clear_order_caches()
     
     def create_invoices_table(self):
-        """Create invoices Delta table"""
+        """Create invoices Delta table, discarding invoices still waiting to be flushed"""
+        # Hold the flush lock so no in-flight batch lands in the new table
+        with self._flush_lock:
+            self._take_invoice_buffer()
+            self._create_invoices_table()
+    
+    def _take_invoice_buffer(self) -> List[Dict]:
+        """Empty the invoice buffer, cancel the pending flush and return the rows"""
+        with self._buffer_lock:
+            batch = self._invoice_buffer
+            self._invoice_buffer = []
+            self._buffer_started = None
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+        return batch
+    
+    def _create_invoices_table(self):
         if self.mock_mode:
             print("Mock: Creating invoices table")
-            self.mock_data["invoices"] = []
+            self.reset_mock_table("invoices")
+            _clear_invoice_caches()
             return
         
         if not DATABRICKS_AVAILABLE:
             print("Databricks not available, using mock mode")
-            self.mock_data["invoices"] = []
+            self.reset_mock_table("invoices")
             return
         
         try:
-            schema = StructType([
-                StructField("invoice_id", StringType(), False),
-                StructField("order_id", StringType(), False),
-                StructField("customer_id", StringType(), False),
-                StructField("invoice_number", StringType(), True),
-                StructField("invoice_date", TimestampType(), True),
-                StructField("amount", DoubleType(), True),
-                StructField("tax_amount", DoubleType(), True),
-                StructField("total_amount", DoubleType(), True),
-                StructField("file_path", StringType(), True),
-                StructField("uploaded_at", TimestampType(), True),
-                StructField("created_at", TimestampType(), True)
-            ])
-            
-            # Create empty DataFrame with schema
-            empty_df = self.spark.createDataFrame([], schema)
-            
-            # Write as Delta table
-            empty_df.write \
-                .format("delta") \
-                .mode("overwrite") \
-                .option("path", Config.DELTA_TABLE_PATH) \
-                .saveAsTable("invoices")
+            # (Re)create as an empty Delta table
+            self.spark.sql(_invoices_ddl("CREATE OR REPLACE TABLE"))
+            self._ready_tables.add("invoices")
             
             print(f"Invoices table created at {Config.DELTA_TABLE_PATH}")
         except Exception as e:
             print(f"Error creating invoices table: {e}")
             print("Switching to mock mode")
             self.mock_mode = True
-            self.mock_data["invoices"] = []
+            self.reset_mock_table("invoices")
+        finally:
+            _clear_invoice_caches()
+    
+    def optimize_tables(self) -> Dict[str, str]:
+        """Compact and Z-ORDER the orders and invoices tables
+        
+        Returns the error message for each table that could not be optimized;
+        an empty dict means both succeeded.
+        """
+        if self.mock_mode:
+            print("Mock: Optimizing tables")
+            return {}
+        
+        failures = {}
+        for table_name, zorder_by in (("orders", ["customer_id", "order_date"]),
+                                      ("invoices", ["customer_id", "invoice_number"])):
+            try:
+                self._optimize_table(table_name, zorder_by)
+            except Exception as e:
+                print(f"Error optimizing table {table_name}: {e}")
+                failures[table_name] = str(e)
+        return failures
+    
+    def ensure_orders_table(self):
+        """Create the orders table with auto-optimize enabled if it does not exist yet"""
+        if "orders" in self._ready_tables:
+            return
+        self.spark.sql(_orders_ddl("CREATE TABLE IF NOT EXISTS"))
+        # CREATE TABLE IF NOT EXISTS leaves an existing table as it is
+        self._migrate_order_items()
+        self._ready_tables.add("orders")
+    
+    def _migrate_order_items(self):
+        """Convert an orders table that still stores items as JSON strings to ARRAY<STRUCT>"""
+        orders = self.spark.read.table("orders")
+        if not isinstance(orders.schema["items"].dataType, StringType):
+            return
+        
+        print("Migrating orders.items from JSON strings to ARRAY<STRUCT>")
+        try:
+            # Delta reads the current snapshot, so the table can overwrite itself
+            orders.withColumn("items", F.from_json("items", ArrayType(ORDER_ITEM_SCHEMA))) \
+                .write \
+                .format("delta") \
+                .mode("overwrite") \
+                .option("overwriteSchema", "true") \
+                .save(Config.ORDERS_TABLE_PATH)
+        except Exception as e:
+            raise TableMigrationError(
+                f"The orders table stores items as JSON strings and could not be upgraded: {e}. "
+                "Recreate it with 'Initialize Orders Table' in Settings."
+            ) from e
+        finally:
+            self.invalidate_orders_cache()
+            _clear_order_caches()
+    
+    def ensure_invoices_table(self):
+        """Create the invoices table with auto-optimize enabled if it does not exist yet"""
+        self._ensure_table("invoices", _invoices_ddl("CREATE TABLE IF NOT EXISTS"))
+    
+    def _ensure_table(self, table_name: str, ddl: str):
+        """Run a table's DDL once per manager so later appends can skip the catalog"""
+        if table_name not in self._ready_tables:
+            self.spark.sql(ddl)
+            self._ready_tables.add(table_name)
+    
+    def _optimize_table(self, table_name: str, zorder_by: List[str]):
+        """Enable auto-optimize and Z-ORDER a table on its most filtered columns"""
+        self.spark.sql(f"ALTER TABLE {table_name} SET TBLPROPERTIES ({_tblproperties_sql()})")
+        self.spark.sql(f"OPTIMIZE {table_name} ZORDER BY ({', '.join(zorder_by)})")
+    
+    def _orders_table(self):
+        """Orders table as a Spark DataFrame, cached in executor memory across queries"""
+        with self._orders_lock:
+            if self._orders_cache is not None and time.monotonic() - self._orders_cached_at > Config.ORDERS_CACHE_TTL:
+                # Bound staleness for writes made by other processes
+                self.invalidate_orders_cache()
+            orders = self._orders_cache
+            if orders is None:
+                orders = self.spark.read.table("orders").cache()
+                orders.count()  # Materialize the cache
+                self._orders_cache = orders
+                self._orders_cached_at = time.monotonic()
+            return orders
+    
+    def invalidate_orders_cache(self):
+        """Drop the cached orders DataFrame so the next query re-reads Delta"""
+        with self._orders_lock:
+            if self._orders_cache is None:
+                return
+            try:
+                self._orders_cache.unpersist()
+            except Exception as e:
+                print(f"Warning: could not unpersist orders cache: {e}")
+            self._orders_cache = None
     
     def save_invoice_to_delta(self, invoice_data: Dict) -> bool:
-        """Save invoice data to Delta table"""
+        """Queue invoice data for the next batched Delta append"""
         if self.mock_mode:
             print("Mock: Saving invoice to Delta table")
-            self.mock_data["invoices"].append(invoice_data)
+            self.add_mock_rows("invoices", [invoice_data])
+            _clear_invoice_caches()
             return True
         
-        try:
-            # Convert to DataFrame
-            df = self.spark.createDataFrame([invoice_data])
+        with self._buffer_lock:
+            # Copy so later mutation by the caller cannot change the buffered row
+            self._invoice_buffer.append(dict(invoice_data))
+            if self._buffer_started is None:
+                self._buffer_started = time.monotonic()
+            flush_now = (
+                len(self._invoice_buffer) >= Config.INVOICE_BATCH_SIZE
+                or time.monotonic() - self._buffer_started >= Config.INVOICE_FLUSH_INTERVAL
+            )
+            if not flush_now and self._flush_timer is None:
+                self._flush_timer = threading.Timer(Config.INVOICE_FLUSH_INTERVAL, self.flush_invoices)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+        
+        if flush_now:
+            self.flush_invoices()
+        return True
+    
+    def flush_invoices(self) -> int:
+        """Append all buffered invoices to the Delta table in a single write"""
+        with self._flush_lock:
+            batch = self._take_invoice_buffer()
+            if not batch:
+                return 0
             
-            # Append to Delta table
-            df.write \
-                .format("delta") \
-                .mode("append") \
-                .option("path", Config.DELTA_TABLE_PATH) \
-                .saveAsTable("invoices")
+            if self.mock_mode:
+                self.add_mock_rows("invoices", batch)
+                _clear_invoice_caches()
+                return len(batch)
             
-            return True
-        except Exception as e:
-            print(f"Error saving invoice to Delta: {e}")
-            print("Switching to mock mode")
-            self.mock_mode = True
-            self.mock_data["invoices"].append(invoice_data)
-            return True
+            try:
+                # Convert to DataFrame; the explicit schema skips per-call inference
+                df = self.spark.createDataFrame(batch, INVOICE_SCHEMA)
+                
+                # Append to the Delta path; the table is registered once up front
+                self.ensure_invoices_table()
+                df.write \
+                    .format("delta") \
+                    .mode("append") \
+                    .option("mergeSchema", "true") \
+                    .save(Config.DELTA_TABLE_PATH)
+            except Exception as e:
+                print(f"Error saving invoices to Delta: {e}")
+                print("Switching to mock mode")
+                self.mock_mode = True
+                self.add_mock_rows("invoices", batch)
+            finally:
+                _clear_invoice_caches()
+            return len(batch)
+    
+    def get_orders_data(self, customer_id: Optional[str] = None,
+                        columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """Get orders data from Delta table (memoized across reruns)"""
+        return self.get_orders_with_lookup(customer_id, columns)[0]
+    
+    def get_orders_with_lookup(self, customer_id: Optional[str] = None,
+                               columns: Optional[List[str]] = None) -> Tuple[pd.DataFrame, Dict[str, Dict]]:
+        """Get orders data plus the same rows keyed by order_id (memoized across reruns)"""
+        if customer_id:
+            _validate_id(customer_id)
+        return _fetch_orders(self, customer_id, columns)
     
-    def get_orders_data(self, customer_id: Optional[str] = None) -> pd.DataFrame:
-        """Get orders data from Delta table"""
+    def get_invoices_data(self, customer_id: Optional[str] = None,
+                          columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """Get invoices data from Delta table (memoized across reruns)"""
+        if customer_id:
+            _validate_id(customer_id)
+        # Read-your-writes: make pending uploads visible before serving the cache
+        self.flush_invoices()
+        return _fetch_invoices(self, customer_id, columns)
+    
+    def _load_orders(self, customer_id: Optional[str] = None,
+                     columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """Load orders data from Delta table, pruning rows and columns in Spark"""
         if self.mock_mode:
             print("Mock: Getting orders data")
-            data = self.mock_data["orders"]
-            if customer_id:
-                data = [order for order in data if order.get("customer_id") == customer_id]
-            return pd.DataFrame(data)
+            return self._load_mock("orders", customer_id, columns)
         
         try:
-            if customer_id:
-                query = f"SELECT * FROM orders WHERE customer_id = '{customer_id}'"
-            else:
-                query = "SELECT * FROM orders"
-            
-            df = self.spark.sql(query)
-            return df.toPandas()
+            # Default to the app's columns so the partition column stays internal
+            return _prune(self._orders_table(), customer_id, columns or ORDER_COLUMNS).toPandas()
         except Exception as e:
             print(f"Error getting orders data: {e}")
             print("Switching to mock mode")
             self.mock_mode = True
-            data = self.mock_data["orders"]
-            if customer_id:
-                data = [order for order in data if order.get("customer_id") == customer_id]
-            return pd.DataFrame(data)
+            return self._load_mock("orders", customer_id, columns)
     
-    def get_invoices_data(self, customer_id: Optional[str] = None) -> pd.DataFrame:
-        """Get invoices data from Delta table"""
+    def _load_invoices(self, customer_id: Optional[str] = None,
+                       columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """Load invoices data from Delta table, pruning rows and columns in Spark"""
         if self.mock_mode:
             print("Mock: Getting invoices data")
-            data = self.mock_data["invoices"]
-            if customer_id:
-                data = [invoice for invoice in data if invoice.get("customer_id") == customer_id]
-            return pd.DataFrame(data)
+            return self._load_mock("invoices", customer_id, columns)
         
         try:
-            if customer_id:
-                query = f"SELECT * FROM invoices WHERE customer_id = '{customer_id}'"
-            else:
-                query = "SELECT * FROM invoices"
-            
-            df = self.spark.sql(query)
-            return df.toPandas()
+            return _prune(self.spark.read.table("invoices"), customer_id, columns).toPandas()
         except Exception as e:
             print(f"Error getting invoices data: {e}")
             print("Switching to mock mode")
             self.mock_mode = True
-            data = self.mock_data["invoices"]
-            if customer_id:
-                data = [invoice for invoice in data if invoice.get("customer_id") == customer_id]
-            return pd.DataFrame(data)
+            return self._load_mock("invoices", customer_id, columns)
+    
+    def get_dashboard_summary(self) -> Dict:
+        """Get order/invoice counts and revenue totals (memoized across reruns)"""
+        self.flush_invoices()
+        return _fetch_dashboard_summary(self)
+    
+    def get_recent_orders(self, n: int = 10) -> pd.DataFrame:
+        """Get the n most recent orders (memoized across reruns)"""
+        return _fetch_recent_orders(self, n)
+    
+    def get_daily_orders(self) -> pd.DataFrame:
+        """Get the number of orders per day (memoized across reruns)"""
+        return _fetch_daily_orders(self)
+    
+    def get_status_revenue(self) -> pd.DataFrame:
+        """Get total order amount per status (memoized across reruns)"""
+        return _fetch_status_revenue(self)
+    
+    def _load_dashboard_summary(self) -> Dict:
+        """Aggregate dashboard metrics in Spark and collect only the result row"""
+        if self.mock_mode:
+            return self._mock_dashboard_summary()
+        
+        try:
+            summary = self._orders_table().agg(
+                F.count(F.lit(1)).alias("order_count"),
+                F.sum("total_amount").alias("total_revenue"),
+                F.avg("total_amount").alias("avg_order_value")
+            ).first().asDict()
+            return {
+                "order_count": summary["order_count"],
+                "invoice_count": self.spark.read.table("invoices").count(),
+                "total_revenue": summary["total_revenue"] or 0.0,
+                "avg_order_value": summary["avg_order_value"] or 0.0
+            }
+        except Exception as e:
+            print(f"Error getting dashboard summary: {e}")
+            print("Switching to mock mode")
+            self.mock_mode = True
+            return self._mock_dashboard_summary()
+    
+    def _load_recent_orders(self, n: int) -> pd.DataFrame:
+        """Sort and limit in Spark so only n rows are collected"""
+        if self.mock_mode:
+            return self._mock_recent_orders(n)
+        
+        try:
+            return self._orders_table() \
+                .orderBy(F.col("order_date").desc()) \
+                .limit(n) \
+                .select(*DASHBOARD_ORDER_COLUMNS) \
+                .toPandas()
+        except Exception as e:
+            print(f"Error getting recent orders: {e}")
+            print("Switching to mock mode")
+            self.mock_mode = True
+            return self._mock_recent_orders(n)
+    
+    def _load_daily_orders(self) -> pd.DataFrame:
+        """Count orders per day in Spark"""
+        if self.mock_mode:
+            return self._mock_daily_orders()
+        
+        try:
+            return self._orders_table() \
+                .groupBy(F.to_date("order_date").alias("Date")) \
+                .agg(F.count(F.lit(1)).alias("Orders")) \
+                .orderBy("Date") \
+                .toPandas()
+        except Exception as e:
+            print(f"Error getting daily orders: {e}")
+            print("Switching to mock mode")
+            self.mock_mode = True
+            return self._mock_daily_orders()
+    
+    def _load_status_revenue(self) -> pd.DataFrame:
+        """Sum order amounts per status in Spark"""
+        if self.mock_mode:
+            return self._mock_status_revenue()
+        
+        try:
+            return self._orders_table() \
+                .groupBy("status") \
+                .agg(F.sum("total_amount").alias("total_amount")) \
+                .toPandas()
+        except Exception as e:
+            print(f"Error getting revenue by status: {e}")
+            print("Switching to mock mode")
+            self.mock_mode = True
+            return self._mock_status_revenue()
+    
+    def _mock_dashboard_summary(self) -> Dict:
+        """Dashboard metrics computed from the in-memory mock store"""
+        orders = self._mock_table("orders")
+        return {
+            "order_count": len(orders),
+            "invoice_count": len(self._mock_table("invoices")),
+            "total_revenue": float(orders["total_amount"].sum()) if not orders.empty else 0.0,
+            "avg_order_value": float(orders["total_amount"].mean()) if not orders.empty else 0.0
+        }
+    
+    def _mock_recent_orders(self, n: int) -> pd.DataFrame:
+        """Most recent orders from the in-memory mock store"""
+        orders = self._mock_table("orders")
+        return orders.sort_values("order_date", ascending=False).head(n)[DASHBOARD_ORDER_COLUMNS]
+    
+    def _mock_daily_orders(self) -> pd.DataFrame:
+        """Orders per day computed from the in-memory mock store"""
+        order_dates = pd.to_datetime(self._mock_table("orders")["order_date"]).dt.date
+        daily_orders = order_dates.groupby(order_dates).size().reset_index()
+        daily_orders.columns = ['Date', 'Orders']
+        return daily_orders
+    
+    def _mock_status_revenue(self) -> pd.DataFrame:
+        """Revenue per status computed from the in-memory mock store"""
+        return self._mock_table("orders").groupby('status')['total_amount'].sum().reset_index()
+    
+    def _load_mock(self, table: str, customer_id: Optional[str] = None,
+                   columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """Load rows from the in-memory mock store"""
+        df = self._mock_table(table)
+        if customer_id:
+            df = df[df["customer_id"].eq(customer_id)]
+        if columns:
+            df = df[columns]
+        # Callers may add columns to the result; never hand out the store itself
+        return df.copy()
+    
+    def add_mock_rows(self, table: str, rows: List[Dict]):
+        """Queue rows for an in-memory mock table"""
+        with self._mock_lock:
+            self._mock_pending[table].extend(rows)
+    
+    def reset_mock_table(self, table: str):
+        """Empty an in-memory mock table, including queued rows"""
+        with self._mock_lock:
+            self.mock_data[table] = pd.DataFrame(columns=MOCK_TABLE_COLUMNS[table])
+            self._mock_pending[table] = []
+    
+    def _mock_table(self, table: str) -> pd.DataFrame:
+        """In-memory mock table with queued rows appended in a single concat"""
+        with self._mock_lock:
+            pending = self._mock_pending[table]
+            if pending:
+                self._mock_pending[table] = []
+                new_rows = pd.DataFrame(pending, columns=MOCK_TABLE_COLUMNS[table])
+                current = self.mock_data[table]
+                self.mock_data[table] = new_rows if current.empty else pd.concat([current, new_rows], ignore_index=True)
+            return self.mock_data[table]
+
+# orjson handles datetimes natively; numpy scalars need opting in, default=str covers the rest
+_ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY
+
+def _parse_items(items) -> Optional[List[Dict]]:
+    """Normalize an order's items into a list of dicts (None if unparseable)
+    
+    Items are stored as ARRAY<STRUCT>; JSON strings written by older
+    versions of the orders table are still decoded.
+    """
+    if isinstance(items, (str, bytes)):
+        if not items:
+            return []
+        try:
+            return orjson.loads(items)
+        except orjson.JSONDecodeError:
+            return None
+    try:
+        return [item.asDict() if hasattr(item, "asDict") else dict(item) for item in items]
+    except TypeError:
+        # Missing value (None/NaN)
+        return []
+
+# Cached data loaders
+# Streamlit reruns the whole script on every interaction; memoizing the reads
+# keeps page switches from round-tripping to Spark. The leading underscore on
+# `_db_manager` excludes it from the cache key. A short TTL bounds staleness
+# for writes made outside this process.
+@st.cache_data(ttl=60, show_spinner=False)
+def _fetch_orders(_db_manager: DatabricksManager, customer_id: Optional[str] = None,
+                  columns: Optional[List[str]] = None) -> Tuple[pd.DataFrame, Dict[str, Dict]]:
+    """Fetch orders for a customer (or all customers), with a by-order_id lookup"""
+    orders_df = _db_manager._load_orders(customer_id, columns)
+    
+    # Parse dates once per load rather than on every page render
+    if "order_date" in orders_df.columns:
+        orders_df["order_date"] = pd.to_datetime(orders_df["order_date"], format="ISO8601")
+        orders_df["order_date_day"] = orders_df["order_date"].dt.date
+    
+    # Decode items once per load instead of per order on every details view
+    if "items" in orders_df.columns:
+        orders_df["items"] = orders_df["items"].map(_parse_items)
+    
+    # Built in the same cache entry as the frame so the two never disagree;
+    # every id in a filtered view of the frame is a key here
+    orders_by_id = {}
+    if "order_id" in orders_df.columns:
+        orders_by_id = orders_df.drop_duplicates('order_id').set_index('order_id', drop=False).to_dict(orient='index')
+    return orders_df, orders_by_id
+
+@st.cache_data(ttl=60, show_spinner=False)
+def _fetch_invoices(_db_manager: DatabricksManager, customer_id: Optional[str] = None,
+                    columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """Fetch invoices for a customer (or all customers)"""
+    return _db_manager._load_invoices(customer_id, columns)
+
+@st.cache_data(ttl=60, show_spinner=False)
+def _fetch_dashboard_summary(_db_manager: DatabricksManager) -> Dict:
+    """Fetch dashboard metrics"""
+    return _db_manager._load_dashboard_summary()
+
+@st.cache_data(ttl=60, show_spinner=False)
+def _fetch_recent_orders(_db_manager: DatabricksManager, n: int = 10) -> pd.DataFrame:
+    """Fetch the most recent orders"""
+    return _db_manager._load_recent_orders(n)
+
+@st.cache_data(ttl=60, show_spinner=False)
+def _fetch_daily_orders(_db_manager: DatabricksManager) -> pd.DataFrame:
+    """Fetch orders per day"""
+    return _db_manager._load_daily_orders()
+
+@st.cache_data(ttl=60, show_spinner=False)
+def _fetch_status_revenue(_db_manager: DatabricksManager) -> pd.DataFrame:
+    """Fetch revenue per order status"""
+    return _db_manager._load_status_revenue()
+
+def _clear_order_caches():
+    """Invalidate every cached read derived from the orders table"""
+    _fetch_orders.clear()
+    _fetch_dashboard_summary.clear()
+    _fetch_recent_orders.clear()
+    _fetch_daily_orders.clear()
+    _fetch_status_revenue.clear()
+
+def _clear_invoice_caches():
+    """Invalidate every cached read derived from the invoices table"""
+    _fetch_invoices.clear()
+    _fetch_dashboard_summary.clear()
 
 # Lakebase Client (Mock Implementation)
 class LakebaseClient:
@@ -329,6 +848,8 @@ class LakebaseClient:
     
     def __init__(self):
         self.data_dir = "lakebase_data"
+        self._row_counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
         self._ensure_data_dir()
     
     def _ensure_data_dir(self):
@@ -337,43 +858,63 @@ class LakebaseClient:
             os.makedirs(self.data_dir)
     
     def _get_file_path(self, table_name: str) -> str:
-        """Get the file path for a table"""
-        return os.path.join(self.data_dir, f"{table_name}.json")
+        """Get the file path for a table (one JSON document per line)"""
+        return os.path.join(self.data_dir, f"{table_name}.jsonl")
     
-    def _load_table_data(self, table_name: str) -> List[Dict]:
-        """Load data from a table file"""
+    def _migrate_legacy_table(self, table_name: str):
+        """Convert a table saved as one JSON array (<table>.json) to JSON Lines
+        
+        Runs once, before the first append, when only the legacy file exists.
+        The legacy file is left in place.
+        """
         file_path = self._get_file_path(table_name)
-        if os.path.exists(file_path):
-            with open(file_path, 'r') as f:
-                return json.load(f)
-        return []
+        legacy_path = os.path.join(self.data_dir, f"{table_name}.json")
+        if os.path.exists(file_path) or not os.path.exists(legacy_path):
+            return
+        with open(legacy_path, 'rb') as f:
+            rows = orjson.loads(f.read())
+        tmp_path = f"{file_path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.writelines(orjson.dumps(row, default=str, option=_ORJSON_OPTIONS) + b"\n" for row in rows)
+        os.replace(tmp_path, file_path)
+    
+    def _count_rows(self, table_name: str) -> int:
+        """Number of rows in a table, counted from disk once and then tracked in memory"""
+        if table_name not in self._row_counts:
+            self._migrate_legacy_table(table_name)
+            file_path = self._get_file_path(table_name)
+            count = 0
+            if os.path.exists(file_path):
+                with open(file_path, 'r') as f:
+                    count = sum(1 for line in f if line.strip())
+            self._row_counts[table_name] = count
+        return self._row_counts[table_name]
     
-    def _save_table_data(self, table_name: str, data: List[Dict]):
-        """Save data to a table file"""
+    def _append_table_row(self, table_name: str, row: Dict) -> int:
+        """Append a single row to a table file and return the new row count"""
+        # Count (and migrate) before the append creates the file
+        count = self._count_rows(table_name) + 1
         file_path = self._get_file_path(table_name)
-        with open(file_path, 'w') as f:
-            json.dump(data, f, indent=2, default=str)
+        with open(file_path, 'ab') as f:
+            f.write(orjson.dumps(row, default=str, option=_ORJSON_OPTIONS) + b"\n")
+        self._row_counts[table_name] = count
+        return count
     
     def save_invoice(self, invoice_data: Dict) -> Dict:
         """Save invoice data to Lakebase"""
         print(f"Mock: Saving invoice to Lakebase")
         
-        # Load existing data
-        existing_data = self._load_table_data("invoices")
-        
-        # Add new data
-        invoice_data["_id"] = f"invoice_{len(existing_data)}_{datetime.now().timestamp()}"
-        invoice_data["_created_at"] = datetime.now().isoformat()
-        existing_data.append(invoice_data)
-        
-        # Save updated data
-        self._save_table_data("invoices", existing_data)
+        with self._lock:
+            # Add metadata and append; existing rows are never re-read or rewritten
+            invoice_data["_id"] = f"invoice_{self._count_rows('invoices')}_{datetime.now().timestamp()}"
+            invoice_data["_created_at"] = datetime.now().isoformat()
+            total_records = self._append_table_row("invoices", invoice_data)
         
         return {
             "status": "success",
             "table_name": "invoices",
             "inserted_count": 1,
-            "total_records": len(existing_data)
+            "total_records": total_records
         }
 
 # Page configuration
@@ -393,6 +934,18 @@ def get_databricks_manager():
 def get_lakebase_client():
     return LakebaseClient()
 
+@st.cache_resource
+def get_upload_dir(day: date):
+    # One directory per day keeps listings small as uploads accumulate
+    upload_dir = os.path.join(Config.UPLOAD_DIR, f"yyyy={day:%Y}", f"mm={day:%m}", f"dd={day:%d}")
+    os.makedirs(upload_dir, exist_ok=True)
+    return upload_dir
+
+@st.cache_resource
+def get_io_pool():
+    # Invoice file and table writes run here so form submission returns immediately
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="invoice-io")
+
 def main():
     st.title(f"🏢 {Config.APP_NAME}")
     st.markdown("---")
@@ -425,10 +978,10 @@ def show_dashboard(db_manager: DatabricksManager, lakebase_client: LakebaseClien
     
     # Get data
     try:
-        orders_df = db_manager.get_orders_data()
-        invoices_df = db_manager.get_invoices_data()
+        # Everything here is aggregated or limited in Spark; only small results come back
+        summary = db_manager.get_dashboard_summary()
         
-        if orders_df.empty and invoices_df.empty:
+        if summary["order_count"] == 0 and summary["invoice_count"] == 0:
             st.warning("No data available. Please upload some orders and invoices first.")
             return
         
@@ -436,47 +989,41 @@ def show_dashboard(db_manager: DatabricksManager, lakebase_client: LakebaseClien
         col1, col2, col3, col4 = st.columns(4)
         
         with col1:
-            total_orders = len(orders_df) if not orders_df.empty else 0
-            st.metric("Total Orders", total_orders)
+            st.metric("Total Orders", summary["order_count"])
         
         with col2:
-            total_invoices = len(invoices_df) if not invoices_df.empty else 0
-            st.metric("Total Invoices", total_invoices)
+            st.metric("Total Invoices", summary["invoice_count"])
         
         with col3:
-            total_revenue = orders_df['total_amount'].sum() if not orders_df.empty else 0
-            st.metric("Total Revenue", f"${total_revenue:,.2f}")
+            st.metric("Total Revenue", f"${summary['total_revenue']:,.2f}")
         
         with col4:
-            avg_order_value = orders_df['total_amount'].mean() if not orders_df.empty else 0
-            st.metric("Avg Order Value", f"${avg_order_value:,.2f}")
+            st.metric("Avg Order Value", f"${summary['avg_order_value']:,.2f}")
         
         # Charts
         col1, col2 = st.columns(2)
         
         with col1:
-            if not orders_df.empty:
+            if summary["order_count"]:
                 st.subheader("📈 Orders Over Time")
-                orders_df['order_date'] = pd.to_datetime(orders_df['order_date'])
-                daily_orders = orders_df.groupby(orders_df['order_date'].dt.date).size().reset_index()
-                daily_orders.columns = ['Date', 'Orders']
+                daily_orders = db_manager.get_daily_orders()
                 
                 fig = px.line(daily_orders, x='Date', y='Orders', title='Daily Orders')
                 st.plotly_chart(fig, use_container_width=True)
         
         with col2:
-            if not orders_df.empty:
+            if summary["order_count"]:
                 st.subheader("💰 Revenue by Status")
-                status_revenue = orders_df.groupby('status')['total_amount'].sum().reset_index()
+                status_revenue = db_manager.get_status_revenue()
                 
                 fig = px.pie(status_revenue, values='total_amount', names='status', 
                            title='Revenue by Order Status')
                 st.plotly_chart(fig, use_container_width=True)
         
         # Recent orders table
-        if not orders_df.empty:
+        if summary["order_count"]:
             st.subheader("📋 Recent Orders")
-            recent_orders = orders_df.head(10)
+            recent_orders = db_manager.get_recent_orders(10)
             st.dataframe(recent_orders, use_container_width=True)
     
     except Exception as e:
@@ -500,36 +1047,39 @@ def show_orders_page(db_manager: DatabricksManager, lakebase_client: LakebaseCli
     
     # Get orders data
     try:
-        orders_df = db_manager.get_orders_data(customer_filter if customer_filter else None)
+        orders_df, orders_by_id = db_manager.get_orders_with_lookup(customer_filter if customer_filter else None)
         
         if orders_df.empty:
             st.info("No orders found. Create some sample orders or upload data.")
             
             # Sample data creation
             if st.button("Create Sample Orders"):
-                create_sample_orders(db_manager)
-                st.rerun()
+                try:
+                    create_sample_orders(db_manager)
+                except TableMigrationError as e:
+                    st.error(f"❌ {e}")
+                else:
+                    st.rerun()
         else:
             # Apply filters
             if status_filter != "All":
                 orders_df = orders_df[orders_df['status'] == status_filter]
             
             if len(date_range) == 2:
-                orders_df['order_date'] = pd.to_datetime(orders_df['order_date'])
                 orders_df = orders_df[
-                    (orders_df['order_date'].dt.date >= date_range[0]) &
-                    (orders_df['order_date'].dt.date <= date_range[1])
+                    (orders_df['order_date_day'] >= date_range[0]) &
+                    (orders_df['order_date_day'] <= date_range[1])
                 ]
             
             # Display orders
             st.subheader(f"Orders ({len(orders_df)} found)")
-            st.dataframe(orders_df, use_container_width=True)
+            st.dataframe(orders_df.drop(columns='order_date_day'), use_container_width=True)
             
             # Order details
             if not orders_df.empty:
                 selected_order = st.selectbox("Select Order for Details", orders_df['order_id'].tolist())
                 if selected_order:
-                    order_details = orders_df[orders_df['order_id'] == selected_order].iloc[0]
+                    order_details = orders_by_id[selected_order]
                     
                     col1, col2 = st.columns(2)
                     with col1:
@@ -543,15 +1093,14 @@ def show_orders_page(db_manager: DatabricksManager, lakebase_client: LakebaseCli
                     
                     with col2:
                         st.subheader("Order Items")
-                        try:
-                            items = json.loads(order_details['items']) if order_details['items'] else []
-                            if items:
-                                items_df = pd.DataFrame(items)
-                                st.dataframe(items_df, use_container_width=True)
-                            else:
-                                st.info("No items found for this order")
-                        except:
+                        items = order_details['items']
+                        if items is None:
                             st.info("Unable to parse order items")
+                        elif items:
+                            items_df = pd.DataFrame(items)
+                            st.dataframe(items_df, use_container_width=True)
+                        else:
+                            st.info("No items found for this order")
     
     except Exception as e:
         st.error(f"Error loading orders: {e}")
@@ -648,23 +1197,20 @@ def process_invoice_upload(order_id: str, customer_id: str, invoice_number: str,
                          lakebase_client: LakebaseClient):
     """Process invoice upload"""
     try:
-        # Generate unique invoice ID
-        invoice_id = str(uuid.uuid4())
+        _validate_id(order_id, "order_id")
+        _validate_id(customer_id, "customer_id")
+        
+        # Generate unique invoice ID and a single timestamp for the record
+        invoice_id = uuid.uuid4().hex
+        now = datetime.now(timezone.utc)
         
         # Calculate total amount
         total_amount = amount + tax_amount
         
-        # Save file if uploaded
+        # Target path for the uploaded file; written in the background
         file_path = None
         if uploaded_file:
-            # Create uploads directory if it doesn't exist
-            upload_dir = "uploads"
-            os.makedirs(upload_dir, exist_ok=True)
-            
-            # Save file
-            file_path = os.path.join(upload_dir, f"{invoice_id}_{uploaded_file.name}")
-            with open(file_path, "wb") as f:
-                f.write(uploaded_file.getbuffer())
+            file_path = os.path.join(get_upload_dir(now.date()), f"{invoice_id}_{_secure_filename(uploaded_file.name)}")
         
         # Prepare invoice data
         invoice_data = {
@@ -672,33 +1218,66 @@ def process_invoice_upload(order_id: str, customer_id: str, invoice_number: str,
             "order_id": order_id,
             "customer_id": customer_id,
             "invoice_number": invoice_number,
-            "invoice_date": invoice_date,
+            "invoice_date": datetime.combine(invoice_date, datetime.min.time()),
             "amount": amount,
             "tax_amount": tax_amount,
             "total_amount": total_amount,
             "file_path": file_path,
-            "uploaded_at": datetime.now(),
-            "created_at": datetime.now()
+            "file_sha256": None,
+            "uploaded_at": now,
+            "created_at": now
         }
         
-        # Save to Delta table
-        success = db_manager.save_invoice_to_delta(invoice_data)
+        get_io_pool().submit(
+            _persist_invoice, dict(invoice_data), uploaded_file, db_manager, lakebase_client
+        )
         
-        if success:
-            # Also save to Lakebase
-            try:
-                lakebase_client.save_invoice(invoice_data)
-            except Exception as e:
-                st.warning(f"Invoice saved to Delta table but failed to save to Lakebase: {e}")
-            
-            st.success("✅ Invoice uploaded and saved successfully!")
-            st.json(invoice_data)
-        else:
-            st.error("❌ Failed to save invoice")
+        st.success("✅ Invoice uploaded! Saving in the background.")
+        st.json(invoice_data)
     
     except Exception as e:
         st.error(f"Error processing invoice upload: {e}")
 
+# Unbuffered, close-on-exec writes; the file is not fsynced since the
+# invoice record in Delta is the durable copy
+_UPLOAD_OPEN_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_CLOEXEC", 0) | getattr(os, "O_BINARY", 0)
+
+def _copy_upload(uploaded_file, file_path: str) -> str:
+    """Stream an uploaded file to disk in fixed-size chunks and return its SHA-256 hex digest"""
+    digest = hashlib.sha256()
+    uploaded_file.seek(0)
+    fd = os.open(file_path, _UPLOAD_OPEN_FLAGS, 0o640)
+    try:
+        for chunk in iter(lambda: uploaded_file.read(Config.UPLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+            view = memoryview(chunk)
+            while view:
+                view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
+    return digest.hexdigest()
+
+def _persist_invoice(invoice_data: Dict, uploaded_file, db_manager: DatabricksManager,
+                     lakebase_client: LakebaseClient):
+    """Write the uploaded file and save the invoice record (runs on the I/O pool)"""
+    try:
+        # Save file if uploaded
+        if uploaded_file is not None:
+            invoice_data["file_sha256"] = _copy_upload(uploaded_file, invoice_data["file_path"])
+        
+        # Save to Delta table
+        if not db_manager.save_invoice_to_delta(invoice_data):
+            print(f"Failed to save invoice {invoice_data['invoice_id']}")
+            return
+        
+        # Also save to Lakebase
+        try:
+            lakebase_client.save_invoice(invoice_data)
+        except Exception as e:
+            print(f"Invoice saved to Delta table but failed to save to Lakebase: {e}")
+    except Exception as e:
+        print(f"Error persisting invoice {invoice_data['invoice_id']}: {e}")
+
 def show_settings_page(db_manager: DatabricksManager, lakebase_client: LakebaseClient):
     """Display settings page"""
     st.header("⚙️ Settings")
@@ -724,6 +1303,16 @@ def show_settings_page(db_manager: DatabricksManager, lakebase_client: LakebaseC
             except Exception as e:
                 st.error(f"❌ Error creating invoices table: {e}")
     
+    if st.button("Optimize Tables", type="secondary"):
+        try:
+            failures = db_manager.optimize_tables()
+            for table_name, error in failures.items():
+                st.error(f"❌ Error optimizing {table_name} table: {error}")
+            if not failures:
+                st.success("✅ Tables optimized successfully!")
+        except Exception as e:
+            st.error(f"❌ Error optimizing tables: {e}")
+    
     # Sample data
     st.subheader("Sample Data")
     
@@ -757,10 +1346,10 @@ def create_sample_orders(db_manager: DatabricksManager):
             "order_date": datetime.now() - timedelta(days=5),
             "total_amount": 150.00,
             "status": "Completed",
-            "items": json.dumps([
+            "items": [
                 {"item": "Laptop", "quantity": 1, "price": 120.00},
                 {"item": "Mouse", "quantity": 1, "price": 30.00}
-            ]),
+            ],
             "created_at": datetime.now()
         },
         {
@@ -770,9 +1359,9 @@ def create_sample_orders(db_manager: DatabricksManager):
             "order_date": datetime.now() - timedelta(days=3),
             "total_amount": 75.50,
             "status": "Pending",
-            "items": json.dumps([
+            "items": [
                 {"item": "Keyboard", "quantity": 1, "price": 75.50}
-            ]),
+            ],
             "created_at": datetime.now()
         },
         {
@@ -782,28 +1371,37 @@ def create_sample_orders(db_manager: DatabricksManager):
             "order_date": datetime.now() - timedelta(days=1),
             "total_amount": 200.00,
             "status": "Completed",
-            "items": json.dumps([
+            "items": [
                 {"item": "Monitor", "quantity": 1, "price": 200.00}
-            ]),
+            ],
             "created_at": datetime.now()
         }
     ]
     
-    # Save sample orders
-    for order in sample_orders:
-        if db_manager.mock_mode:
-            db_manager.mock_data["orders"].append(order)
-        else:
-            try:
-                df = db_manager.spark.createDataFrame([order])
-                df.write \
-                    .format("delta") \
-                    .mode("append") \
-                    .option("path", Config.ORDERS_TABLE_PATH) \
-                    .saveAsTable("orders")
-            except Exception as e:
-                print(f"Error saving sample order: {e}")
-                db_manager.mock_data["orders"].append(order)
+    # Save sample orders in a single batch (one Delta commit)
+    if db_manager.mock_mode:
+        db_manager.add_mock_rows("orders", sample_orders)
+    else:
+        try:
+            # Make sure a first-time seed creates the table with auto-optimize on;
+            # the append itself then goes straight to the Delta path
+            db_manager.ensure_orders_table()
+            df = db_manager.spark.createDataFrame(sample_orders, ORDER_SCHEMA)
+            df.write \
+                .format("delta") \
+                .mode("append") \
+                .save(Config.ORDERS_TABLE_PATH)
+        except TableMigrationError:
+            # The table is reachable but needs recreating; mock mode would hide that
+            raise
+        except Exception as e:
+            print(f"Error saving sample orders: {e}")
+            print("Switching to mock mode")
+            db_manager.mock_mode = True
+            db_manager.add_mock_rows("orders", sample_orders)
+    
+    db_manager.invalidate_orders_cache()
+    _clear_order_caches()
 
 if __name__ == "__main__":
     main()
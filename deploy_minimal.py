@@ -4,117 +4,211 @@ Deploy Minimal Databricks App
 This script deploys the consolidated Order Management app to Databricks
 """
 
+import logging
 import os
 import sys
+import time
+from functools import lru_cache
 from pathlib import Path
 
+logging.basicConfig(level=logging.INFO, format="%(message)s", stream=sys.stdout)
+log = logging.getLogger("deploy_minimal")
+
+# Import the SDK once at startup rather than on every deploy call. The client
+# and the Apps API are guarded separately so a missing package and an SDK too
+# old for Apps are reported differently
+try:
+    from databricks.sdk import WorkspaceClient
+except ImportError as e:
+    WorkspaceClient = None
+    SDK_IMPORT_ERROR = e
+else:
+    try:
+        from databricks.sdk.service.apps import AppManifest, AppType
+        SDK_IMPORT_ERROR = None
+    except ImportError as e:
+        SDK_IMPORT_ERROR = e
+
+# Errors worth retrying around apps.create. The SDK already retries 429/503
+# itself and raises TimeoutError once that budget is spent, so only network
+# failures from requests and the remaining 5xx types are caught here (the SDK
+# error classes are missing from older releases)
+_transient_errors = []
+try:
+    from requests.exceptions import ConnectionError as RequestsConnectionError, Timeout as RequestsTimeout
+    _transient_errors += [RequestsConnectionError, RequestsTimeout]
+except ImportError:
+    pass
+try:
+    from databricks.sdk.errors import DeadlineExceeded, InternalError
+    _transient_errors += [InternalError, DeadlineExceeded]
+except ImportError:
+    pass
+TRANSIENT_ERRORS = tuple(_transient_errors)
+
+# apps.create is not idempotent: a retried create after a timeout or 5xx may
+# find the app made by the earlier attempt
+try:
+    from databricks.sdk.errors import AlreadyExists, ResourceAlreadyExists
+    ALREADY_EXISTS_ERRORS = (AlreadyExists, ResourceAlreadyExists)
+except ImportError:
+    ALREADY_EXISTS_ERRORS = ()
+
+# App manifest; every field is a literal, so it is built once at import
+if SDK_IMPORT_ERROR is None:
+    _MANIFEST = AppManifest(
+        name="Order Management System",
+        app_type=AppType.STREAMLIT,
+        description="Minimal Order Management System with Databricks Integration",
+        version="1.0.0",
+        main_file="databricks_app_minimal.py",
+        requirements_file="requirements_minimal.txt"
+    )
+else:
+    _MANIFEST = None
+
+CREATE_ATTEMPTS = 3
+RETRY_BASE_DELAY = 0.5
+
+PLACEHOLDER_HOST = 'https://your-workspace.cloud.databricks.com'
+CREDENTIAL_VARS = ('DATABRICKS_HOST', 'DATABRICKS_TOKEN', 'DATABRICKS_CLIENT_ID', 'DATABRICKS_CLIENT_SECRET')
+
+def read_credentials():
+    """Read the Databricks credential environment variables"""
+    return {name: os.environ.get(name) for name in CREDENTIAL_VARS}
+
 def check_credentials():
     """Check if Databricks credentials are configured"""
     # Check environment variables
-    host = os.getenv('DATABRICKS_HOST')
-    token = os.getenv('DATABRICKS_TOKEN')
-    client_id = os.getenv('DATABRICKS_CLIENT_ID')
-    client_secret = os.getenv('DATABRICKS_CLIENT_SECRET')
+    env = read_credentials()
+    host = env['DATABRICKS_HOST']
+    has_pat = bool(env['DATABRICKS_TOKEN'])
+    has_oauth = bool(env['DATABRICKS_CLIENT_ID'] and env['DATABRICKS_CLIENT_SECRET'])
     
-    if not host or host == 'https://your-workspace.cloud.databricks.com':
-        print("❌ DATABRICKS_HOST not configured")
+    if not host or host == PLACEHOLDER_HOST:
+        log.error("❌ DATABRICKS_HOST not configured")
         return False
     
-    if not token and not (client_id and client_secret):
-        print("❌ No authentication method configured")
-        print("Please set either:")
-        print("  - DATABRICKS_TOKEN (for Personal Access Token)")
-        print("  - DATABRICKS_CLIENT_ID and DATABRICKS_CLIENT_SECRET (for OAuth)")
+    if not (has_pat or has_oauth):
+        log.error("❌ No authentication method configured")
+        log.info("Please set either:")
+        log.info("  - DATABRICKS_TOKEN (for Personal Access Token)")
+        log.info("  - DATABRICKS_CLIENT_ID and DATABRICKS_CLIENT_SECRET (for OAuth)")
         return False
     
-    if token and (client_id or client_secret):
-        print("⚠️  Both PAT and OAuth configured. Using OAuth.")
+    if has_pat and has_oauth:
+        log.warning("⚠️  Both PAT and OAuth configured. Using OAuth.")
     
-    print("✅ Credentials configured")
+    log.info("✅ Credentials configured")
     return True
 
+@lru_cache(maxsize=4)
+def _get_workspace_client(host, token, client_id, client_secret):
+    """Create a workspace client, reused for repeat calls with the same credentials"""
+    if client_id and client_secret:
+        config = {
+            'host': host,
+            'client_id': client_id,
+            'client_secret': client_secret
+        }
+    else:
+        config = {
+            'host': host,
+            'token': token
+        }
+    
+    return WorkspaceClient(**config)
+
+def _create_app(workspace_client, manifest):
+    """Create the app, retrying transient failures with exponential backoff"""
+    for attempt in range(CREATE_ATTEMPTS):
+        try:
+            return workspace_client.apps.create(
+                name="Order Management System",
+                manifest=manifest
+            )
+        except ALREADY_EXISTS_ERRORS:
+            if attempt == 0:
+                raise
+            # An earlier attempt reached the server before failing
+            log.info("App was created by an earlier attempt")
+            return workspace_client.apps.get(name="Order Management System")
+        except TRANSIENT_ERRORS as e:
+            if attempt == CREATE_ATTEMPTS - 1:
+                raise
+            delay = RETRY_BASE_DELAY * 2 ** attempt
+            log.warning(f"⚠️  Transient error creating app ({e}), retrying in {delay:.1f}s...")
+            time.sleep(delay)
+
 def deploy_to_databricks():
     """Deploy the minimal app to Databricks"""
-    print("🚀 Deploying Minimal Order Management App to Databricks...")
+    log.info("🚀 Deploying Minimal Order Management App to Databricks...")
     
     if not check_credentials():
-        print("\n📝 Please configure your Databricks credentials:")
-        print("Option 1 (OAuth - Recommended):")
-        print("  export DATABRICKS_HOST=https://your-workspace.cloud.databricks.com")
-        print("  export DATABRICKS_CLIENT_ID=your-client-id")
-        print("  export DATABRICKS_CLIENT_SECRET=your-client-secret")
-        print("  export DATABRICKS_CLUSTER_ID=your-cluster-id")
-        print("\nOption 2 (Personal Access Token):")
-        print("  export DATABRICKS_HOST=https://your-workspace.cloud.databricks.com")
-        print("  export DATABRICKS_TOKEN=your-token")
-        print("  export DATABRICKS_CLUSTER_ID=your-cluster-id")
+        log.info("\n📝 Please configure your Databricks credentials:")
+        log.info("Option 1 (OAuth - Recommended):")
+        log.info(f"  export DATABRICKS_HOST={PLACEHOLDER_HOST}")
+        log.info("  export DATABRICKS_CLIENT_ID=your-client-id")
+        log.info("  export DATABRICKS_CLIENT_SECRET=your-client-secret")
+        log.info("  export DATABRICKS_CLUSTER_ID=your-cluster-id")
+        log.info("\nOption 2 (Personal Access Token):")
+        log.info(f"  export DATABRICKS_HOST={PLACEHOLDER_HOST}")
+        log.info("  export DATABRICKS_TOKEN=your-token")
+        log.info("  export DATABRICKS_CLUSTER_ID=your-cluster-id")
+        return False
+    
+    if WorkspaceClient is None:
+        log.error("❌ databricks-sdk is not installed")
+        log.info("Install it with: pip install databricks-sdk")
+        return False
+    
+    if SDK_IMPORT_ERROR is not None:
+        log.error(f"❌ The installed databricks-sdk does not support Apps: {SDK_IMPORT_ERROR}")
+        log.info("Upgrade it with: pip install --upgrade databricks-sdk")
         return False
     
     try:
-        from databricks.sdk import WorkspaceClient
-        from databricks.sdk.service.apps import AppManifest, AppType
-        
-        # Create workspace client
-        config = {}
-        if os.getenv('DATABRICKS_CLIENT_ID') and os.getenv('DATABRICKS_CLIENT_SECRET'):
-            config = {
-                'host': os.getenv('DATABRICKS_HOST'),
-                'client_id': os.getenv('DATABRICKS_CLIENT_ID'),
-                'client_secret': os.getenv('DATABRICKS_CLIENT_SECRET')
-            }
-        else:
-            config = {
-                'host': os.getenv('DATABRICKS_HOST'),
-                'token': os.getenv('DATABRICKS_TOKEN')
-            }
-        
-        workspace_client = WorkspaceClient(**config)
-        
-        # Create app manifest
-        manifest = AppManifest(
-            name="Order Management System",
-            app_type=AppType.STREAMLIT,
-            description="Minimal Order Management System with Databricks Integration",
-            version="1.0.0",
-            main_file="databricks_app_minimal.py",
-            requirements_file="requirements_minimal.txt"
+        # Get (cached) workspace client
+        env = read_credentials()
+        workspace_client = _get_workspace_client(
+            env['DATABRICKS_HOST'],
+            env['DATABRICKS_TOKEN'],
+            env['DATABRICKS_CLIENT_ID'],
+            env['DATABRICKS_CLIENT_SECRET']
         )
         
         # Deploy app
-        app = workspace_client.apps.create(
-            name="Order Management System",
-            manifest=manifest
-        )
+        app = _create_app(workspace_client, _MANIFEST)
         
-        print(f"✅ App deployed successfully!")
-        print(f"📱 App ID: {app.app_id}")
-        print(f"🌐 Access your app in Databricks workspace under Apps section")
+        log.info("✅ App deployed successfully!")
+        log.info(f"📱 App ID: {app.app_id}")
+        log.info("🌐 Access your app in Databricks workspace under Apps section")
         
         return True
         
     except Exception as e:
-        print(f"❌ Deployment failed: {e}")
-        print("\n🔧 Troubleshooting:")
-        print("1. Check your Databricks credentials")
-        print("2. Ensure you have Apps permissions in Databricks")
-        print("3. Verify your cluster is running")
-        print("4. Make sure you're using the correct workspace URL")
+        log.error(f"❌ Deployment failed: {e}")
+        log.info("\n🔧 Troubleshooting:")
+        log.info("1. Check your Databricks credentials")
+        log.info("2. Ensure you have Apps permissions in Databricks")
+        log.info("3. Verify your cluster is running")
+        log.info("4. Make sure you're using the correct workspace URL")
         return False
 
 def main():
     """Main deployment function"""
-    print("🏢 Minimal Order Management Databricks App - Deployment")
-    print("=" * 60)
+    log.info("🏢 Minimal Order Management Databricks App - Deployment")
+    log.info("=" * 60)
     
     if deploy_to_databricks():
-        print("\n🎉 Deployment completed successfully!")
-        print("📋 Next steps:")
-        print("1. Go to your Databricks workspace")
-        print("2. Navigate to Apps section")
-        print("3. Find your deployed app")
-        print("4. Click to launch the app")
+        log.info("\n🎉 Deployment completed successfully!")
+        log.info("📋 Next steps:")
+        log.info("1. Go to your Databricks workspace")
+        log.info("2. Navigate to Apps section")
+        log.info("3. Find your deployed app")
+        log.info("4. Click to launch the app")
     else:
-        print("\n❌ Deployment failed. Please check the errors above.")
+        log.error("\n❌ Deployment failed. Please check the errors above.")
 
 if __name__ == "__main__":
     main()